@@ -0,0 +1,222 @@
+import json
+import os
+import sys
+
+
+CONTENT_LENGTH = b"Content-Length:"
+CONTENT_LENGTH_SIZE = len(CONTENT_LENGTH)
+HEADER_END = b"\r\n\r\n"
+HEADER_END_SIZE = len(HEADER_END)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ResponseError(Exception):
+    """
+    Raised by a message handler to reply to the request with an error.
+    """
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class MessageReader:
+    """
+    Reads `Content-Length` framed JSON-RPC messages from the file descriptor
+    `fd`.
+
+    Data is read in blocks directly from the file descriptor, bypassing
+    Python's own stdin buffering, and messages are sliced out of the buffer
+    instead of issuing separate reads for the header, the separator line and
+    the body of every message.
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.buffer = bytearray()
+
+    def read(self):
+        """
+        Reads the next block of input into the buffer. Returns `False` once the
+        end of the input has been reached.
+        """
+        data = os.read(self.fd, 65536)
+        self.buffer += data
+        return len(data) != 0
+
+    def messages(self):
+        """
+        Yields every complete message that is currently in the buffer.
+        """
+        while True:
+            header_end = self.buffer.find(HEADER_END)
+            if header_end == -1:
+                return
+            header = self.buffer[:header_end]
+            if header[:CONTENT_LENGTH_SIZE] != CONTENT_LENGTH:
+                raise ProtocolError("malformed message header {!r}".format(bytes(header)))
+            try:
+                length = int(header[CONTENT_LENGTH_SIZE:])
+            except ValueError:
+                raise ProtocolError("malformed message header {!r}".format(bytes(header)))
+            body_start = header_end + HEADER_END_SIZE
+            body_end = body_start + length
+            if len(self.buffer) < body_end:
+                return
+            message = json.loads(self.buffer[body_start:body_end])
+            del self.buffer[:body_end]
+            yield message
+
+
+def encode(data):
+    return json.dumps(data, separators=(",", ":")).encode('utf-8')
+
+
+def result_response(message, result):
+    if result is None:
+        result = b"null"
+    elif not isinstance(result, bytes):
+        result = encode(result)
+    return b'{"jsonrpc":"2.0","id":%s,"result":%s}' % (encode(message["id"]), result)
+
+
+def error_response(message, code, error_message):
+    return b'{"jsonrpc":"2.0","id":%s,"error":{"code":%d,"message":%s}}' % (
+        encode(message["id"]), code, encode(error_message))
+
+
+def frame(body):
+    return b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+
+
+def send(data):
+    # Write straight to the stdout file descriptor, bypassing sys.stdout's
+    # buffer so that no flush is needed after each write.
+    data = memoryview(data)
+    try:
+        while data:
+            data = data[os.write(sys.stdout.fileno(), data):]
+    except IOError:
+        # stdout closed, time to quit
+        raise SystemExit(0)
+
+
+INITIALIZE_RESULT = encode({
+    "displayName": "test server",
+    "version": "0.1",
+    "bspVersion": "2.0",
+    "rootUri": "blah",
+    "capabilities": {"languageIds": ["a", "b"]},
+    "data": {
+        "indexStorePath": "some/index/store/path"
+    }
+})
+
+
+class AbstractBuildServer:
+    """
+    Build server used by `BuildServerBuildSystemTests`.
+
+    Subclasses implement the handlers listed in `HANDLERS` for the methods
+    they support. Handlers receive the request's params and return the
+    result, either already JSON-encoded as bytes or as a JSON-serializable
+    value. Only the handlers a server actually implements are added to its
+    dispatch table; every other request is answered with an `unhandled
+    method` error and other notifications are ignored.
+    """
+
+    # Maps BSP methods to the name of the method that handles them.
+    HANDLERS = {
+        "build/initialize": "initialize",
+        "build/initialized": "initialized",
+        "build/shutdown": "shutdown",
+        "workspace/buildTargets": "build_targets",
+        "buildTarget/sources": "buildtarget_sources",
+        "buildTarget/outputPaths": "buildtarget_output_paths",
+        "textDocument/sourceKitOptions": "sourcekit_options",
+        "textDocument/registerForChanges": "register_for_changes",
+    }
+
+    def __init__(self):
+        self.dispatch = {}
+        for method, name in self.HANDLERS.items():
+            handler = getattr(self, name, None)
+            if handler is not None:
+                self.dispatch[method] = handler
+        self.notifications = []
+
+    def run(self):
+        # Handle every message that arrived with one read before writing, so
+        # that a burst of requests is answered with a single write.
+        reader = MessageReader(sys.stdin.fileno())
+        # Bind the methods used for every message once instead of creating a
+        # new bound method per message.
+        handle_message = self.handle_message
+        notifications = self.notifications
+        while reader.read():
+            frames = []
+            exiting = False
+            for message in reader.messages():
+                method = message["method"]
+                if method == "build/exit":
+                    exiting = True
+                    break
+
+                response = handle_message(method, message)
+                if response:
+                    frames.append(frame(response))
+                if notifications:
+                    frames.extend(frame(body) for body in notifications)
+                    notifications.clear()
+
+            if frames:
+                send(b"".join(frames))
+            if exiting:
+                return
+
+    def handle_message(self, method, message):
+        """
+        Returns the encoded response to `message` or `None` if `message` is a
+        notification.
+        """
+        handler = self.dispatch.get(method)
+        if handler is None:
+            # ignore other notifications
+            if "id" not in message:
+                return None
+            return error_response(message, -32600, "unhandled method {}".format(method))
+
+        try:
+            result = handler(message.get("params"))
+        except ResponseError as error:
+            # notifications can't be answered, not even with an error
+            if "id" not in message:
+                return None
+            return error_response(message, error.code, error.message)
+        if "id" not in message:
+            return None
+        return result_response(message, result)
+
+    def send_notification(self, method, params):
+        """
+        Sends a notification to the client after the response to the message
+        that is currently being handled.
+        """
+        self.notifications.append(encode({
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+        }))
+
+    def initialize(self, params):
+        return INITIALIZE_RESULT
+
+    def initialized(self, params):
+        return None
+
+    def shutdown(self, params):
+        return None
@@ -1,14 +1,17 @@
 #!/usr/bin/env python3
 
 import argparse
+import concurrent.futures
+import copy
 import json
 import os
 import platform
+import shlex
 import shutil
 import subprocess
 import sys
 import tempfile
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 
 # -----------------------------------------------------------------------------
@@ -20,16 +23,9 @@ def fatal_error(message):
     raise SystemExit(1)
 
 
-def escapeCmdArg(arg: str) -> str:
-    if '"' in arg or " " in arg:
-        return '"%s"' % arg.replace('"', '\\"')
-    else:
-        return arg
-
-
 def print_cmd(cmd: List[str], additional_env: Dict[str, str]) -> None:
-    env_str = " ".join([f"{key}={escapeCmdArg(str(value))}" for (key, value) in additional_env.items()])
-    command_str = " ".join([escapeCmdArg(str(arg)) for arg in cmd])
+    env_str = " ".join([f"{key}={shlex.quote(str(value))}" for (key, value) in additional_env.items()])
+    command_str = " ".join([shlex.quote(str(arg)) for arg in cmd])
     print(f"{env_str} {command_str}")
 
 
@@ -40,43 +36,54 @@ def env_with_additional_env(additional_env: Dict[str, str]) -> Dict[str, str]:
     return env
 
 
-def check_call(cmd: List[str], additional_env: Dict[str, str] = {}, verbose: bool = False) -> None:
+def check_call(cmd: List[str], additional_env: Dict[str, str] = {}, verbose: bool = False, env: Optional[Dict[str, str]] = None) -> None:
     if verbose:
         print_cmd(cmd=cmd, additional_env=additional_env)
+    if env is None:
+        env = env_with_additional_env(additional_env)
 
-    subprocess.check_call(cmd, env=env_with_additional_env(additional_env), stderr=subprocess.STDOUT)
+    subprocess.check_call(cmd, env=env, stderr=subprocess.STDOUT)
 
 
-def check_output(cmd: List[str], additional_env: Dict[str, str] = {}, capture_stderr: bool = True, verbose: bool = False) -> str:
+def check_output(cmd: List[str], additional_env: Dict[str, str] = {}, capture_stderr: bool = True, verbose: bool = False, env: Optional[Dict[str, str]] = None) -> str:
     if verbose:
         print_cmd(cmd=cmd, additional_env=additional_env)
     if capture_stderr:
         stderr = subprocess.STDOUT
     else:
         stderr = subprocess.DEVNULL
-    return subprocess.check_output(cmd, env=env_with_additional_env(additional_env), stderr=stderr, encoding='utf-8')
+    if env is None:
+        env = env_with_additional_env(additional_env)
+    return subprocess.check_output(cmd, env=env, stderr=stderr, encoding='utf-8')
 
 # -----------------------------------------------------------------------------
 # SwiftPM wrappers
 
 
-def swiftpm_bin_path(swift_exec: str, swiftpm_args: List[str], additional_env: Dict[str, str], verbose: bool = False) -> str:
+def swiftpm_bin_path(swift_exec: str, swiftpm_args: List[str], additional_env: Dict[str, str], verbose: bool = False, env: Optional[Dict[str, str]] = None) -> str:
     """
     Return the path of the directory that contains the binaries produced by this package.
     """
     cmd = [swift_exec, 'build', '--show-bin-path'] + swiftpm_args
-    return check_output(cmd, additional_env=additional_env, capture_stderr=False, verbose=verbose).strip()
+    return check_output(cmd, additional_env=additional_env, capture_stderr=False, verbose=verbose, env=env).strip()
+
+
+# Parsed output of `swift -print-target-info`, keyed by the swift executable and
+# the cross-compilation config it was queried for.
+_target_info_cache: Dict[Tuple[str, Optional[str]], Dict] = {}
 
 
 def get_build_target(swift_exec: str, args: argparse.Namespace, cross_compile: bool = False) -> str:
     """Returns the target-triple of the current machine or for cross-compilation."""
     try:
-        command = [swift_exec, '-print-target-info']
-        if cross_compile:
-            cross_compile_json = json.load(open(args.cross_compile_config))
-            command += ['-target', cross_compile_json["target"]]
-        target_info_json = subprocess.check_output(command, stderr=subprocess.PIPE, universal_newlines=True).strip()
-        args.target_info = json.loads(target_info_json)
+        cache_key = (swift_exec, args.cross_compile_config if cross_compile else None)
+        if cache_key not in _target_info_cache:
+            command = [swift_exec, '-print-target-info']
+            if cross_compile:
+                command += ['-target', args.cross_compile_config_data["target"]]
+            target_info_json = subprocess.check_output(command, stderr=subprocess.PIPE, universal_newlines=True).strip()
+            _target_info_cache[cache_key] = json.loads(target_info_json)
+        args.target_info = _target_info_cache[cache_key]
         if '-apple-macosx' in args.target_info["target"]["unversionedTriple"]:
             return args.target_info["target"]["unversionedTriple"]
         return args.target_info["target"]["triple"]
@@ -96,6 +103,7 @@ def get_swiftpm_options(swift_exec: str, args: argparse.Namespace, suppress_verb
         '--package-path', args.package_path,
         '--scratch-path', args.build_path,
         '--configuration', args.configuration,
+        '--jobs', str(args.jobs),
     ]
 
     if args.multiroot_data_file:
@@ -191,22 +199,42 @@ def get_swiftpm_environment_variables(swift_exec: str, args: argparse.Namespace)
     return env
 
 
-def build_single_product(product: str, swift_exec: str, args: argparse.Namespace) -> None:
+def get_bin_path(swift_exec: str, args: argparse.Namespace, swiftpm_args: List[str], additional_env: Dict[str, str], env: Dict[str, str]) -> str:
+    """
+    Return the path of the directory that contains the binaries produced by this package.
+
+    SwiftPM places the products of a build for the host in
+    `<build path>/<triple>/<configuration>`. If that directory exists, use it instead of
+    launching `swift build --show-bin-path`.
+    """
+    if not args.cross_compile_host and not args.cross_compile_config:
+        build_target = get_build_target(swift_exec, args)
+        # Only trust the triple if it came from `swift -print-target-info` and isn't
+        # `get_build_target`'s Darwin fallback.
+        if getattr(args, 'target_info', None) is not None:
+            bin_path = os.path.join(args.build_path, build_target, args.configuration)
+            if os.path.isdir(bin_path):
+                return bin_path
+    return swiftpm_bin_path(swift_exec, swiftpm_args, additional_env=additional_env, env=env)
+
+
+def build_single_product(product: str, swift_exec: str, args: argparse.Namespace, swiftpm_args: List[str], additional_env: Dict[str, str], env: Dict[str, str]) -> None:
     """
     Build one product in the package
     """
-    swiftpm_args = get_swiftpm_options(swift_exec, args)
-    additional_env = get_swiftpm_environment_variables(swift_exec, args)
     cmd = [swift_exec, 'build', '--product', product] + swiftpm_args
-    check_call(cmd, additional_env=additional_env, verbose=args.verbose)
+    check_call(cmd, additional_env=additional_env, verbose=args.verbose, env=env)
+
+
+def build(swift_exec: str, args: argparse.Namespace, swiftpm_args: List[str], additional_env: Dict[str, str], env: Dict[str, str]) -> None:
+    build_single_product('sourcekit-lsp', swift_exec, args, swiftpm_args, additional_env, env)
 
 
-def run_tests(swift_exec: str, args: argparse.Namespace) -> None:
+def run_tests(swift_exec: str, args: argparse.Namespace, swiftpm_args: List[str], additional_env: Dict[str, str], env: Dict[str, str]) -> None:
     """
     Run all tests in the package
     """
-    swiftpm_args = get_swiftpm_options(swift_exec, args, suppress_verbose=True)
-    additional_env = get_swiftpm_environment_variables(swift_exec, args)
+    additional_env = dict(additional_env)
     # 'swift test' doesn't print os_log output to the command line. Use the
     # `NonDarwinLogger` that prints to stderr so we can view the log output in CI test
     # runs.
@@ -218,10 +246,11 @@ def run_tests(swift_exec: str, args: argparse.Namespace) -> None:
     # Log with the highest log level to simplify debugging of CI failures.
     additional_env['SOURCEKITLSP_LOG_LEVEL'] = 'debug'
 
-    bin_path = swiftpm_bin_path(swift_exec, swiftpm_args, additional_env=additional_env)
+    bin_path = get_bin_path(swift_exec, args, swiftpm_args, additional_env=additional_env, env=env)
     tests = os.path.join(bin_path, 'sk-tests')
-    print('Cleaning ' + tests)
-    shutil.rmtree(tests, ignore_errors=True)
+    if os.path.isdir(tests):
+        print('Cleaning ' + tests)
+        shutil.rmtree(tests, ignore_errors=True)
 
     cmd = [
         swift_exec, 'test',
@@ -231,45 +260,78 @@ def run_tests(swift_exec: str, args: argparse.Namespace) -> None:
 
     with tempfile.TemporaryDirectory() as test_module_cache:
         additional_env['SOURCEKIT_LSP_TEST_MODULE_CACHE'] = f"{test_module_cache}/module-cache"
+        test_env = env_with_additional_env(additional_env)
         # Try running tests in parallel. If that fails, run tests in serial to get capture more readable output.
         try:
-            check_call(cmd + ['--parallel'], additional_env=additional_env, verbose=args.verbose)
+            check_call(cmd + ['--parallel'], additional_env=additional_env, verbose=args.verbose, env=test_env)
         except:
             print('--- Running tests in parallel failed. Re-running tests serially to capture more actionable output.')
             sys.stdout.flush()
-            check_call(cmd, additional_env=additional_env, verbose=args.verbose)
+            check_call(cmd, additional_env=additional_env, verbose=args.verbose, env=test_env)
             # Return with non-zero exit code even if serial test execution succeeds.
             raise SystemExit(1)
 
 
 def install_binary(exe: str, source_dir: str, install_dir: str, verbose: bool) -> None:
-    cmd = ['rsync', '-a', os.path.join(source_dir, exe), install_dir]
-    check_call(cmd, verbose=verbose)
+    source = os.path.join(source_dir, exe)
+    destination = os.path.join(install_dir, exe)
+    if verbose:
+        print(f"Installing {source} to {destination}")
+    os.makedirs(install_dir, exist_ok=True)
+    # Like rsync, copy to a temporary file next to the destination and move it into
+    # place so that an executable that is currently running isn't written to.
+    (fd, temporary) = tempfile.mkstemp(dir=install_dir, prefix='.' + exe)
+    os.close(fd)
+    try:
+        shutil.copy2(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
 
 
-def install(swift_exec: str, args: argparse.Namespace) -> None:
-    build_single_product('sourcekit-lsp', swift_exec, args)
+def install(swift_exec: str, args: argparse.Namespace, swiftpm_args: List[str], additional_env: Dict[str, str], env: Dict[str, str]) -> None:
+    build_single_product('sourcekit-lsp', swift_exec, args, swiftpm_args, additional_env, env)
 
-    swiftpm_args = get_swiftpm_options(swift_exec, args)
-    additional_env = get_swiftpm_environment_variables(swift_exec, args)
-    bin_path = swiftpm_bin_path(swift_exec, swiftpm_args=swiftpm_args, additional_env=additional_env)
+    bin_path = get_bin_path(swift_exec, args, swiftpm_args, additional_env=additional_env, env=env)
 
-    for prefix in args.install_prefixes:
-        install_binary('sourcekit-lsp', bin_path, os.path.join(prefix, 'bin'), verbose=args.verbose)
+    # Install to every directory only once, even if it is passed multiple times.
+    prefixes = list({os.path.realpath(prefix): prefix for prefix in args.install_prefixes}.values())
+
+    # Copy to all prefixes at once, they might live on different disks.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(prefixes)) as executor:
+        futures = [
+            executor.submit(install_binary, 'sourcekit-lsp', bin_path, os.path.join(prefix, 'bin'), verbose=args.verbose)
+            for prefix in prefixes
+        ]
+        for future in futures:
+            future.result()
 
 
 def handle_invocation(swift_exec: str, args: argparse.Namespace) -> None:
     """
     Depending on the action in 'args', build the package, installs the package or run tests.
     """
-    if args.action == 'build':
-        build_single_product("sourcekit-lsp", swift_exec, args)
-    elif args.action == 'test':
-        run_tests(swift_exec, args)
-    elif args.action == 'install':
-        install(swift_exec, args)
-    else:
-        fatal_error(f"unknown action '{args.action}'")
+    # Don't pass --verbose to 'swift test'.
+    swiftpm_args = get_swiftpm_options(swift_exec, args, suppress_verbose=(args.action == 'test'))
+    additional_env = get_swiftpm_environment_variables(swift_exec, args)
+    # Build the environment for the SwiftPM invocations only once.
+    env = env_with_additional_env(additional_env)
+    args.func(swift_exec, args, swiftpm_args, additional_env, env)
+
+
+def handle_sanitizer_invocation(swift_exec: str, args: argparse.Namespace, name: str, sanitizer: str, build_path: str, jobs: int) -> None:
+    """
+    Perform the action in 'args' with the given sanitizer in 'build_path', using 'jobs'
+    parallel build jobs.
+    """
+    print('=== %s sourcekit-lsp with %s ===' % (args.action, name))
+    sanitizer_args = copy.copy(args)
+    sanitizer_args.sanitize = [sanitizer]
+    sanitizer_args.build_path = build_path
+    sanitizer_args.jobs = jobs
+    handle_invocation(swift_exec, sanitizer_args)
 
 # -----------------------------------------------------------------------------
 # Argument parsing
@@ -300,13 +362,16 @@ def parse_args() -> argparse.Namespace:
 
     build_parser = subparsers.add_parser('build', help='build the package')
     add_common_args(build_parser)
+    build_parser.set_defaults(func=build)
 
     test_parser = subparsers.add_parser('test', help='test the package')
     add_common_args(test_parser)
+    test_parser.set_defaults(func=run_tests)
     test_parser.add_argument('--skip-long-tests', action='store_true', help='skip run long-running tests')
 
     install_parser = subparsers.add_parser('install', help='build the package')
     add_common_args(install_parser)
+    install_parser.set_defaults(func=install)
     install_parser.add_argument('--prefix', dest='install_prefixes', nargs='*', metavar='PATHS', help="paths to install sourcekit-lsp, default: 'toolchain/bin'")
 
     args = parser.parse_args(sys.argv[1:])
@@ -319,6 +384,28 @@ def parse_args() -> argparse.Namespace:
     args.build_path = os.path.abspath(args.build_path)
     args.toolchain = os.path.abspath(args.toolchain)
 
+    if args.cross_compile_config:
+        try:
+            with open(args.cross_compile_config) as cross_compile_config:
+                args.cross_compile_config_data = json.load(cross_compile_config)
+        except (OSError, ValueError) as e:
+            fatal_error(f"failed to read cross-compilation config '{args.cross_compile_config}': {e}")
+
+    # Build with every core this process may run on unless the number of jobs is limited
+    # explicitly, e.g. because the CPU quota of a container is lower than that.
+    jobs = os.environ.get('SOURCEKIT_LSP_BUILD_JOBS')
+    if jobs:
+        try:
+            args.jobs = int(jobs)
+        except ValueError:
+            args.jobs = 0
+        if args.jobs < 1:
+            fatal_error(f"SOURCEKIT_LSP_BUILD_JOBS must be a positive integer, got '{jobs}'")
+    elif hasattr(os, 'sched_getaffinity'):
+        args.jobs = len(os.sched_getaffinity(0))
+    else:
+        args.jobs = os.cpu_count() or 1
+
     if args.action == 'install':
         if not args.install_prefixes:
             args.install_prefixes = [args.toolchain]
@@ -338,23 +425,39 @@ def main() -> None:
 
     if args.sanitize_all:
         base = args.build_path
-
-        print('=== %s sourcekit-lsp with asan ===' % args.action)
-        args.sanitize = ['address']
-        args.build_path = os.path.join(base, 'test-asan')
-        handle_invocation(swift_exec, args)
-
-        print('=== %s sourcekit-lsp with tsan ===' % args.action)
-        args.sanitize = ['thread']
-        args.build_path = os.path.join(base, 'test-tsan')
-        handle_invocation(swift_exec, args)
-
+        sanitizers = [('asan', 'address'), ('tsan', 'thread')]
         # Linux ubsan disabled: https://bugs.swift.org/browse/SR-12550
         if platform.system() != 'Linux':
-            print('=== %s sourcekit-lsp with ubsan ===' % args.action)
-            args.sanitize = ['undefined']
-            args.build_path = os.path.join(base, 'test-ubsan')
-            handle_invocation(swift_exec, args)
+            sanitizers.append(('ubsan', 'undefined'))
+
+        if args.action != 'build':
+            # Run the test and install passes one after the other. 'swift test
+            # --parallel' already uses every core and the logs of concurrent test runs
+            # would interleave. All install passes install to the same prefixes, so the
+            # last pass has to be the one whose binary ends up installed.
+            for (name, sanitizer) in sanitizers:
+                handle_sanitizer_invocation(swift_exec, args, name, sanitizer, os.path.join(base, 'test-' + name), args.jobs)
+            return
+
+        # The sanitizer builds use separate build directories, so they can run
+        # concurrently. Every build is parallel by itself, so only run as many at once
+        # as there are cores to spare and split the build jobs between them.
+        max_workers = max(1, min(len(sanitizers), args.jobs // 4))
+        jobs = max(1, args.jobs // max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (name, executor.submit(handle_sanitizer_invocation, swift_exec, args, name, sanitizer, os.path.join(base, 'test-' + name), jobs))
+                for (name, sanitizer) in sanitizers
+            ]
+        # Report every failed pass, not just the first one.
+        failed = False
+        for (name, future) in futures:
+            error = future.exception()
+            if error is not None:
+                print('=== %s sourcekit-lsp with %s failed: %s ===' % (args.action, name, error), file=sys.stderr)
+                failed = True
+        if failed:
+            raise SystemExit(1)
 
 
 if __name__ == '__main__':